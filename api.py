@@ -1,7 +1,7 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, Request, UploadFile, File, HTTPException
 from fastapi.responses import JSONResponse
 import os
-import shutil
+import aiofiles
 from pathlib import Path
 
 app = FastAPI(title="Claim Resubmission API", version="1.0.0")
@@ -10,11 +10,57 @@ app = FastAPI(title="Claim Resubmission API", version="1.0.0")
 UPLOAD_DIR = "uploads"
 OUTPUTS_DIR = "outputs"
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+MULTIPART_OVERHEAD = 64 * 1024  # headroom for multipart framing in Content-Length
 ALLOWED_EXTENSIONS = {".json", ".csv"}
 
 # Create upload directory if it doesn't exist
 Path(UPLOAD_DIR).mkdir(exist_ok=True)
 
+def list_directory(directory):
+    """
+    List the files in a directory with their size and modification time
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                files.append({
+                    "filename": entry.name,
+                    "size": stat.st_size,
+                    "modified": stat.st_mtime
+                })
+    return files
+
+def file_too_large():
+    """
+    Error raised when an upload exceeds MAX_FILE_SIZE
+    """
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024*1024):.1f}MB"
+    )
+
+@app.middleware("http")
+async def reject_large_uploads(request: Request, call_next):
+    """
+    Reject uploads that are clearly too large before the multipart body is parsed,
+    the exact limit is enforced while streaming the file to disk
+    """
+    if request.url.path == "/upload":
+        try:
+            content_length = int(request.headers.get("content-length", "0"))
+        except ValueError:
+            content_length = 0
+        if content_length > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+            error = file_too_large()
+            return JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+    return await call_next(request)
+
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     """
@@ -27,13 +73,6 @@ async def upload_file(file: UploadFile = File(...)):
         JSON response with upload status and file info
     """
     
-    # Check file size
-    if file.size > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File too large. Maximum size is {MAX_FILE_SIZE / (1024*1024):.1f}MB"
-        )
-    
     # Check file extension
     file_extension = Path(file.filename).suffix.lower()
     if file_extension not in ALLOWED_EXTENSIONS:
@@ -45,20 +84,33 @@ async def upload_file(file: UploadFile = File(...)):
     try:
         # Generate safe filename
         safe_filename = f"{file.filename}"
-        file_path = Path(UPLOAD_DIR) / safe_filename
+        name = Path(file.filename).stem
+        ext = Path(file.filename).suffix
         
-        # Handle filename conflicts
+        # Handle filename conflicts, O_EXCL creates the file atomically
         counter = 1
-        while file_path.exists():
-            name = Path(file.filename).stem
-            ext = Path(file.filename).suffix
-            safe_filename = f"{name}_{counter}{ext}"
+        while True:
             file_path = Path(UPLOAD_DIR) / safe_filename
-            counter += 1
+            try:
+                fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                break
+            except FileExistsError:
+                safe_filename = f"{name}_{counter}{ext}"
+                counter += 1
+        
+        # Save file, streaming in chunks so the event loop is never blocked
+        # and counting bytes so oversized files are aborted before being fully written
+        file_size = 0
+        async with aiofiles.open(fd, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > MAX_FILE_SIZE:
+                    break
+                await buffer.write(chunk)
         
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        if file_size > MAX_FILE_SIZE:
+            file_path.unlink()
+            raise file_too_large()
         
         return JSONResponse(
             status_code=200,
@@ -66,12 +118,14 @@ async def upload_file(file: UploadFile = File(...)):
                 "message": "File uploaded successfully",
                 "filename": safe_filename,
                 "original_filename": file.filename,
-                "file_size": file.size,
+                "file_size": file_size,
                 "content_type": file.content_type,
                 "file_path": str(file_path)
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -84,20 +138,7 @@ async def list_files():
     List all uploaded files
     """
     try:
-        files = []
-        upload_path = Path(UPLOAD_DIR)
-        
-        if upload_path.exists():
-            for file_path in upload_path.iterdir():
-                if file_path.is_file():
-                    stat = file_path.stat()
-                    files.append({
-                        "filename": file_path.name,
-                        "size": stat.st_size,
-                        "modified": stat.st_mtime
-                    })
-        
-        return {"files": files}
+        return {"files": list_directory(UPLOAD_DIR)}
         
     except Exception as e:
         raise HTTPException(
@@ -111,20 +152,7 @@ async def list_outputs():
     List all files output from the pipeline
     """
     try:
-        files = []
-        upload_path = Path(OUTPUTS_DIR)
-        
-        if upload_path.exists():
-            for file_path in upload_path.iterdir():
-                if file_path.is_file():
-                    stat = file_path.stat()
-                    files.append({
-                        "filename": file_path.name,
-                        "size": stat.st_size,
-                        "modified": stat.st_mtime
-                    })
-        
-        return {"files": files}
+        return {"files": list_directory(OUTPUTS_DIR)}
         
     except Exception as e:
         raise HTTPException(
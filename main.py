@@ -1,113 +1,184 @@
+import numpy as np
 import pandas as pd
-import json
+import gc
 import logging
+import os
+import orjson
+import pyarrow as pa
+from pyarrow import json as pa_json
+from pathlib import Path
 from prefect import flow, task
+from prefect.task_runners import ConcurrentTaskRunner
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional, fall back to NumPy masks
+    njit = None
+
+try:
+    import dask.dataframe as dd
+except ImportError:  # dask is optional, frames are then flagged in-process
+    dd = None
 
 CSV_INPUT_FILE = "./uploads/emr_alpha.csv"
 JSON_INPUT_FILE= "./uploads/emr_beta.json"
 RESUBMISSION_CANDIDATES_JSON_FILE = "./outputs/resubmission_candidates.json"
 FAILED_RECORDS_OUTPUT_FILE = "./outputs/failed_records.json"
 CLAIM_METRICS_OUTPUT_FILE = "./outputs/claims_metrics.json"
-METRICS = {
-    "total_claims": 0,
-    "total_claims_alpha_csv": 0,
-    "total_claims_beta_json": 0,
-    "total_resubmission_eligible": 0,
-    "total_approved": 0,
-    "total_failed": 0
+DASK_MIN_ROWS = 1_000_000  # without numba, partition across cores from this many claims
+TODAY = np.datetime64("2025-07-30")  # assumed run date for the 7 day rule
+SCHEMA_MAP = {
+    "id": "claim_id",
+    "member": "patient_id",
+    "code": "procedure_code",
+    "error_msg": "denial_reason",
+    "status": "status",
+    "date": "submitted_at",
+    "source_system": "alpha or beta"
 }
+KNOWN_RETRYABLE_REASONS = frozenset({
+    "missing modifier", "incorrect npi", "prior auth required"
+})
+# Heuristic classifier for ambiguous cases
+AMBIGUOUS_RETRYABLE_REASONS = frozenset({
+    "incorrect procedure", "form incomplete", "not billable", "null"
+})
+KNOWN_NON_RETRYABLE_REASONS = frozenset({
+    "authorization expired", "incorrect provider type"
+})
 
 @task(log_prints=True)
 def read_json():
-    return pd.read_json(JSON_INPUT_FILE)
+    with open(JSON_INPUT_FILE, "rb") as f:
+        raw = f.read()
+
+    # A single JSON document (array of records or columns object),
+    # otherwise newline-delimited JSON
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return pa_json.read_json(pa.BufferReader(raw)).to_pandas(types_mapper=pd.ArrowDtype)
+
+    # A lone record, e.g. a one-line NDJSON file
+    if isinstance(data, dict) and not any(isinstance(value, (dict, list)) for value in data.values()):
+        data = [data]
+    return pd.DataFrame(data).convert_dtypes(dtype_backend="pyarrow")
 
 @task(log_prints=True)
 def read_csv():
-    return pd.read_csv(CSV_INPUT_FILE)
-
-
-def unified_schema_map():
-    return {
-        "id": "claim_id",
-        "member": "patient_id",
-        "code": "procedure_code",
-        "error_msg": "denial_reason",
-        "status": "status",
-        "date": "submitted_at",
-        "source_system": "alpha or beta"
-    }
+    # Dates stay strings so both sources are parsed by pd.to_datetime the same way
+    return pd.read_csv(
+        CSV_INPUT_FILE, engine="pyarrow", dtype_backend="pyarrow",
+        dtype={"submitted_at": "string[pyarrow]"}
+    )
+
 
 @task(log_prints=True)
 def transform_data(df, source):
-    schema_map = unified_schema_map()
-
     # unify schema
-    df_transformed = df.rename(columns=schema_map)
+    df_transformed = df.rename(columns=SCHEMA_MAP)
+
+    # Arrow-backed strings, so .str.lower()/.isin() run on Arrow compute kernels
+    # (cast first: columns typed from the data may be numeric or all-null)
+    text_columns = ["patient_id", "denial_reason", "status"]
+    df_transformed[text_columns] = df_transformed[text_columns].astype("string[pyarrow]")
 
     # Handling null/None values for "denial_reason" and "patient_id"
     df_transformed.fillna({ "denial_reason": "null"}, inplace=True)
     df_transformed.fillna({ "patient_id": "null"}, inplace=True)
     
-    # Ensure date is in ISO format (already in ISO format, but we can standardize it)
-    df_transformed["submitted_at"] = pd.to_datetime(df_transformed["submitted_at"]).dt.strftime('%Y-%m-%dT%H:%M:%S')
+    # Keep dates as datetime64 instead of formatting every row back to a string
+    # (timezones are dropped, keeping the local wall time as before)
+    submitted_at = pd.to_datetime(df_transformed["submitted_at"])
+    if submitted_at.dt.tz is not None:
+        submitted_at = submitted_at.dt.tz_localize(None)
+    df_transformed["submitted_at"] = submitted_at.astype("datetime64[ns]")
 
     # Status should be either "approved" or "denied" – no changes needed, but can clean up
-    df_transformed["status"] = df_transformed["status"].apply(lambda x: x if x in ["approved", "denied"] else "denied")
+    df_transformed["status"] = df_transformed["status"].where(df_transformed["status"].isin(["approved", "denied"]), "denied")
 
     # Adding the new field 'source_system' with a constant value
     df_transformed["source_system"] = source
 
     return df_transformed
 
-@task(log_prints=True)
-def check_resubmission(row):
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def flag_resubmission(status, denied_code, patient_null, days, reason, retryable):
+        """
+        Native per-row eligibility kernel, reason codes index the retryable lookup
+        """
+        out = np.empty(status.size, np.bool_)
+        for i in prange(status.size):
+            code = reason[i]
+            out[i] = (
+                status[i] == denied_code
+                and not patient_null[i]
+                and days[i] > 7
+                and code >= 0
+                and retryable[code]
+            )
+        return out
+else:
+    flag_resubmission = None
+
+def reason_codes(categories, reasons):
     """
-    Check resubmission eligibility per Column
+    Integer codes of the categories whose lower-cased value is in reasons
     """
-    # Check if submitted more than 7 days ago
-    submitted_date = pd.to_datetime(row["submitted_at"])
-    today = pd.to_datetime('2025-07-30')
-    days_since_submission = (today - submitted_date).days
-
-    if row["status"] == "denied" and row["patient_id"] != "null" and days_since_submission > 7: 
-
-            # Fetch denial reason       
-            denial_reason = row["denial_reason"].lower() if row["denial_reason"] != "null" else ""
-            
-            # Check if denial reason is a known retryable reason
-            known_retryable_reasons = [
-                "Missing modifier", "Incorrect NPI", "Prior auth required"
-            ]
-
-            # Check for known retryable reasons
-            for reason in known_retryable_reasons:
-                if reason.lower() == denial_reason:
-                    return True
-            
-            # Heuristic classifier for ambiguous cases
-            ambiguous_examples = ["incorrect procedure", "form incomplete", "not billable", "null"]
-            for example in ambiguous_examples:
-                if example.lower() == denial_reason:
-                    return True
-    
-    return False 
+    # "null" placeholders never match a reason
+    matches = categories.str.lower().isin(reasons) & (categories != "null")
+    return np.flatnonzero(matches).astype(np.int32)
 
-@task(log_prints=True)
-def check_failed(row):
+def check_resubmission(df):
+    """
+    Check resubmission eligibility for every row at once
 
-    # Fetch denial reason       
-    denial_reason = row["denial_reason"].lower() if row["denial_reason"] != "null" else ""
+    Not a Prefect task: it is a helper of resubmission_logic, tasks stay at
+    the per-frame level and per-row or per-mask helpers must never be tasks
+    """
+    # Check if submitted more than 7 days ago
+    submitted_date = df["submitted_at"].to_numpy(dtype="datetime64[ns]")
+    days = (TODAY - submitted_date).astype("timedelta64[D]").astype(np.int64)
+
+    # Status and denial reason are categorical, compare integer codes only
+    status = df["status"].cat
+    denied_code = status.categories.get_indexer(["denied"])[0]
+    retry_codes = reason_codes(
+        df["denial_reason"].cat.categories,
+        KNOWN_RETRYABLE_REASONS | AMBIGUOUS_RETRYABLE_REASONS
+    )
+
+    status_codes = status.codes.to_numpy()
+    patient_null = df["patient_id"].to_numpy() == "null"
+    denial_codes = df["denial_reason"].cat.codes.to_numpy()
+
+    if flag_resubmission is not None:
+        retryable = np.zeros(len(df["denial_reason"].cat.categories), dtype=np.bool_)
+        retryable[retry_codes] = True
+        return flag_resubmission(status_codes, denied_code, patient_null, days, denial_codes, retryable)
+
+    return (
+        (status_codes == denied_code)
+        & ~patient_null
+        & (days > 7)
+        & np.isin(denial_codes, retry_codes)
+    )
+
+def check_failed(df):
+    """
+    Check for failed claims for every row at once (a helper, not a task)
+    """
+    # Check for known non-retryable reasons
+    failed_codes = reason_codes(df["denial_reason"].cat.categories, KNOWN_NON_RETRYABLE_REASONS)
 
-    known_non_retryable_reasons = [
-        "Authorization expired", "Incorrect provider type"
-    ]
+    return np.isin(df["denial_reason"].cat.codes.to_numpy(), failed_codes)
 
-    # Check for known non-retryable reasons
-    for reason in known_non_retryable_reasons:
-        if reason.lower() == denial_reason:
-            return True
-        
-    return False
+def flag_partition(df):
+    """
+    Resubmission eligibility of a single dask partition
+    """
+    return pd.Series(check_resubmission(df), index=df.index)
 
 @task(log_prints=True)
 def resubmission_logic(df):
@@ -122,93 +193,115 @@ def resubmission_logic(df):
     o OR inferred as retryable via LLM/heuristic
     classifier if ambiguous
     """
-    df_flaggable = df.copy()
-    df_flaggable['resubmission_eligible'] = df_flaggable.apply(check_resubmission, axis=1)
-    return df_flaggable
-
-@task(log_prints=True)
-def automated_resubmission_output(df):
+    # The combined frame is not reused by the caller, so flag it in place
+    df["status"] = df["status"].astype("category")
+    df["denial_reason"] = df["denial_reason"].astype("category")
+    # The numba kernel already uses every core and is not safe to call from
+    # dask's worker threads, so only partition when it is unavailable
+    if flag_resubmission is None and dd is not None and len(df) >= DASK_MIN_ROWS:
+        partitions = dd.from_pandas(df, npartitions=os.cpu_count() or 1)
+        eligible = partitions.map_partitions(
+            flag_partition, meta=("resubmission_eligible", bool)
+        ).compute().to_numpy()
+    else:
+        eligible = check_resubmission(df)
+    df['resubmission_eligible'] = eligible
+    return df
+
+def json_default(value):
     """
-    Produce a list of claims eligible for automated resubmission, including:
+    Serialize missing values from Arrow-backed columns (pd.NA) as null
     """
-    # Filter out resubmission_eligible
-    df_resubmission = df[df['resubmission_eligible'] == True]
-    print(df_resubmission)
-
-    # denial_reason to resubmission_reason
-    df_resubmission = df_resubmission.rename(columns={'denial_reason': 'resubmission_reason'})
-
-    # introduce recommended_changes
-    df_resubmission["recommended_changes"] = ""
+    if value is pd.NA:
+        return None
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
 
-    # only required columns
-    df_resubmission = df_resubmission[['claim_id', 'resubmission_reason', 'source_system', 'recommended_changes']]
-
-    # Save the filtered DataFrame as JSON
-    df_resubmission.to_json(RESUBMISSION_CANDIDATES_JSON_FILE, orient='records', lines=False)
-
-    METRICS["total_resubmission_eligible"] = len(df_resubmission)
+def write_records(df, path):
+    """
+    Save a DataFrame as a JSON list of records, built column-wise for orjson
+    """
+    columns = {column: df[column].tolist() for column in df.columns}
+    records = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(records, default=json_default))
 
 @task(log_prints=True)
-def output_failed(df):
+def write_outputs(df):
     """
-    Produce a list of claims that failed:
+    Produce, in a single pass over the flagged claims:
+    - the list of claims eligible for automated resubmission
+    - the list of claims that failed
+    and return how many claims ended up in each list
     """
-    df_failed = df.copy()
-    df_failed['failed'] = df_failed.apply(check_failed, axis=1)
-    
-    # Filter out failed
-    df_failed = df_failed[df_failed['failed'] == True]
+    eligible = df['resubmission_eligible'].to_numpy()
+    failed = check_failed(df)
+
+    # Resubmission candidates: denial_reason to resubmission_reason, introduce recommended_changes
+    df_resubmission = (
+        df.loc[eligible, ['claim_id', 'denial_reason', 'source_system']]
+        .rename(columns={'denial_reason': 'resubmission_reason'})
+        .assign(recommended_changes="")
+    )
+    print(df_resubmission)
 
-    # only required columns
-    df_failed = df_failed[['claim_id', 'denial_reason', 'source_system']]
+    # Failed records: only required columns
+    df_failed = df.loc[failed, ['claim_id', 'denial_reason', 'source_system']]
 
-    # Save the filtered DataFrame as JSON
-    df_failed.to_json(FAILED_RECORDS_OUTPUT_FILE, orient='records', lines=False)
+    # Save the filtered DataFrames as JSON
+    write_records(df_resubmission, RESUBMISSION_CANDIDATES_JSON_FILE)
+    write_records(df_failed, FAILED_RECORDS_OUTPUT_FILE)
 
-    METRICS["total_failed"] = len(df_failed)
+    return int(eligible.sum()), int(failed.sum())
 
 @task(log_prints=True)
-def aggregate_metrics():
-    with open(CLAIM_METRICS_OUTPUT_FILE, 'w') as f:
-        json.dump(METRICS, f)
-    logging.info(f"Metrics saved to ${CLAIM_METRICS_OUTPUT_FILE}")
+def aggregate_metrics(metrics):
+    Path(CLAIM_METRICS_OUTPUT_FILE).write_bytes(orjson.dumps(metrics, option=orjson.OPT_INDENT_2))
+    logging.info(f"Metrics saved to {CLAIM_METRICS_OUTPUT_FILE}")
 
-@flow(name="claim_resubmission_ingestion")
+@flow(name="claim_resubmission_ingestion", task_runner=ConcurrentTaskRunner())
 def claim_resubmission_ingestion():
 
-    # Read both files
+    # Read both files concurrently
     logging.info("Loading json and csv files")
-    df_json = read_json()
-    df_csv = read_csv()
+    df_json = read_json.submit()
+    df_csv = read_csv.submit()
 
-    # 1. Schema Normalization: transform both frames
+    # 1. Schema Normalization: transform both frames concurrently
     logging.info("Starting Schema Normalization")
-    df_transformed_json = transform_data(df=df_json, source="beta")
-    METRICS["total_claims_beta_json"] = len(df_transformed_json)
-    df_transformed_csv  = transform_data(df=df_csv, source="alpha")
-    METRICS["total_claims_alpha_csv"] = len(df_transformed_csv)
+    transformed_json = transform_data.submit(df=df_json, source="beta")
+    transformed_csv = transform_data.submit(df=df_csv, source="alpha")
+    df_transformed_json = transformed_json.result()
+    df_transformed_csv = transformed_csv.result()
     
     # 1.1: combine both dataframes
     logging.info("Combining json and csv dataframes")
     df_combined = pd.concat([df_transformed_json, df_transformed_csv], ignore_index=True)
-    METRICS["total_claims"] = len(df_combined)
+    metrics = {
+        "total_claims": len(df_combined),
+        "total_claims_alpha_csv": len(df_transformed_csv),
+        "total_claims_beta_json": len(df_transformed_json),
+        "total_resubmission_eligible": 0,
+        "total_approved": 0,
+        "total_failed": 0
+    }
+
+    # Release the per-source frames (and the futures holding them) before flagging
+    del df_json, df_csv, transformed_json, transformed_csv, df_transformed_json, df_transformed_csv
+    gc.collect()
 
     # 2. Flag for resubmission
     logging.info("Flagging records for resubmission")
     df_flagged = resubmission_logic(df_combined)
 
-    # 3. Filter and Save output
-    logging.info("Saving records due for resubmission")
-    automated_resubmission_output(df_flagged)
-
-    # 4. Output_failed
-    logging.info("Saving failed records output")
-    output_failed(df_flagged)
+    # 3. Filter and Save outputs: records due for resubmission and failed records
+    logging.info("Saving records due for resubmission and failed records output")
+    metrics["total_resubmission_eligible"], metrics["total_failed"] = write_outputs(df_flagged)
+    del df_flagged, df_combined
+    gc.collect()
 
-    # 5. Output_metrcis
+    # 4. Output_metrcis
     logging.info("Finalizing metrcis aggregation")
-    aggregate_metrics()
+    aggregate_metrics(metrics)
         
 
 if __name__ == "__main__":